@@ -4,14 +4,15 @@ from matplotlib.dates import YearLocator, DateFormatter
 import seaborn as sns
 import numpy as np
 
-# Read the CSV data
-df = pd.read_csv('sleep_history.csv')
-
-# Convert date to datetime
-df['date'] = pd.to_datetime(df['date'])
-
-# Set date as index
-df.set_index('date', inplace=True)
+# Read the CSV data, parsing and indexing by date in the same pass
+df = pd.read_csv(
+    'sleep_history.csv',
+    usecols=['date', 'hours_of_sleep_rounded'],
+    parse_dates=['date'],
+    date_format='%m/%d/%Y',
+    index_col='date',
+    dtype={'hours_of_sleep_rounded': 'float32'}
+)
 
 # Calculate monthly average
 monthly_avg = df.resample('M').mean()
@@ -24,7 +25,7 @@ plt.figure(figsize=(20, 12))
 sns.set_style("whitegrid")
 
 # Plot monthly average with increased linewidth
-plt.plot(monthly_avg.index, monthly_avg['hours_of_sleep_rounded'], color='#1E90FF', linewidth=3)
+plt.plot(monthly_avg.index, monthly_avg['hours_of_sleep_rounded'], color='#1E90FF', linewidth=3, rasterized=True)
 
 # Plot yearly trend line with increased linewidth
 plt.plot(yearly_avg.index, yearly_avg['hours_of_sleep_rounded'], '--', color='#FFA500', linewidth=3)
@@ -53,5 +54,5 @@ plt.legend(['Monthly Average', 'Yearly Trend'], loc='upper right', fontsize=20)
 
 # Adjust layout and save the plot
 plt.tight_layout()
-plt.savefig('results/graphs/sleep_history_graph.png')
+plt.savefig('results/graphs/sleep_history_graph.png', dpi=200)
 plt.show()
\ No newline at end of file
@@ -5,90 +5,130 @@ from oura_api import get_oura_sleep_data, process_sleep_data
 from ultrahuman_api import get_ultrahuman_sleep_data, process_ultrahuman_sleep_data
 import seaborn as sns
 import numpy as np
+from scipy.stats import gaussian_kde
 
 
-def fetch_and_process_data(start_date, end_date):
+def fetch_and_process_data(start_date, end_date, dates_to_exclude=()):
+    # Build the exclusion set once so every per-day check is a hashed lookup
+    dates_to_exclude = set(dates_to_exclude)
+
     # Fetch and process Oura data
-    oura_raw_data = get_oura_sleep_data(start_date, end_date, DATES_TO_EXCLUDE)
-    oura_processed_data = process_sleep_data(oura_raw_data, DATES_TO_EXCLUDE) if oura_raw_data else []
+    oura_raw_data = get_oura_sleep_data(start_date, end_date, dates_to_exclude)
+    oura_processed_data = process_sleep_data(oura_raw_data, dates_to_exclude) if oura_raw_data else []
 
     # Fetch and process Ultrahuman data
-    ultrahuman_raw_data = get_ultrahuman_sleep_data(start_date, end_date, DATES_TO_EXCLUDE)
-    ultrahuman_processed_data = process_ultrahuman_sleep_data(ultrahuman_raw_data, DATES_TO_EXCLUDE) if ultrahuman_raw_data else []
+    ultrahuman_raw_data = get_ultrahuman_sleep_data(start_date, end_date, dates_to_exclude)
+    ultrahuman_processed_data = process_ultrahuman_sleep_data(ultrahuman_raw_data, dates_to_exclude)
 
     return oura_processed_data, ultrahuman_processed_data
 
 def create_dataframes(oura_data, ultrahuman_data, anecdotal_data):
-    oura_df = pd.DataFrame(oura_data)
+    oura_df = pd.DataFrame(oura_data, copy=False)
     ultrahuman_df = pd.DataFrame(ultrahuman_data)
 
     # Convert 'day' column to datetime for easier manipulation
     oura_df['day'] = pd.to_datetime(oura_df['day'])
     ultrahuman_df['day'] = pd.to_datetime(ultrahuman_df['day'])
 
-    # Merge dataframes
-    merged_df = anecdotal_data.merge(oura_df, left_on='Date', right_on='day', how='left')
-    merged_df = merged_df.merge(ultrahuman_df, on='day', how='left', suffixes=('_oura', '_ultrahuman'))
+    # Join on sorted, unique day indexes rather than hashing the day columns in two merges
+    oura_df = oura_df.set_index('day').sort_index()
+    ultrahuman_df = ultrahuman_df.set_index('day').sort_index()
+    device_df = oura_df.join(ultrahuman_df, how='outer', lsuffix='_oura', rsuffix='_ultrahuman', validate='1:1')
+    merged_df = anecdotal_data.sort_values('Date').join(device_df, on='Date', how='left')
 
     # Handle missing data
-    for col in merged_df.columns:
-        if merged_df[col].dtype == 'float64' or merged_df[col].dtype == 'int64':
-            merged_df[col] = merged_df[col].fillna(0)
+    numeric_cols = merged_df.select_dtypes(include=['float64', 'int64']).columns
+    merged_df[numeric_cols] = merged_df[numeric_cols].fillna(0)
 
     return merged_df
 
 def calculate_errors(df):
+    metrics = [
+        ('sleep_start', 'sleeptime_start'),
+        ('total_sleep', 'total_sleep_duration'),
+        ('sleep_end', 'sleeptime_end')
+    ]
+    devices = ['oura', 'ultrahuman']
+
+    device_cols = [f'{device_col}_{device}' for _, device_col in metrics for device in devices]
+    anecdotal_cols = [f'jared_{metric}' for metric, _ in metrics for _ in devices]
+    signed_cols = [f'{metric}_error_{device}' for metric, _ in metrics for device in devices]
+    abs_cols = [f'{metric}_error_abs_{device}' for metric, _ in metrics for device in devices]
+
+    # Directional error (for direction-based analyses), computed once for all six columns
+    diff = np.empty((len(df), len(device_cols)), dtype=np.float64)
+    np.subtract(df[device_cols].to_numpy(dtype=np.float64), df[anecdotal_cols].to_numpy(dtype=np.float64), out=diff)
+
     # Absolute error (for magnitude-based analyses)
-    df['sleep_start_error_abs_oura'] = abs(df['jared_sleep_start'] - df['sleeptime_start_oura'])
-    df['sleep_start_error_abs_ultrahuman'] = abs(df['jared_sleep_start'] - df['sleeptime_start_ultrahuman'])
-    df['total_sleep_error_abs_oura'] = abs(df['jared_total_sleep'] - df['total_sleep_duration_oura'])
-    df['total_sleep_error_abs_ultrahuman'] = abs(df['jared_total_sleep'] - df['total_sleep_duration_ultrahuman'])
-    df['sleep_end_error_abs_oura'] = abs(df['jared_sleep_end'] - df['sleeptime_end_oura'])
-    df['sleep_end_error_abs_ultrahuman'] = abs(df['jared_sleep_end'] - df['sleeptime_end_ultrahuman'])
-
-    # Directional error (for direction-based analyses)
-    df['sleep_start_error_oura'] = df['sleeptime_start_oura'] - df['jared_sleep_start']
-    df['sleep_start_error_ultrahuman'] = df['sleeptime_start_ultrahuman'] - df['jared_sleep_start']
-    df['total_sleep_error_oura'] = df['total_sleep_duration_oura'] - df['jared_total_sleep']
-    df['total_sleep_error_ultrahuman'] = df['total_sleep_duration_ultrahuman'] - df['jared_total_sleep']
-    df['sleep_end_error_oura'] = df['sleeptime_end_oura'] - df['jared_sleep_end']
-    df['sleep_end_error_ultrahuman'] = df['sleeptime_end_ultrahuman'] - df['jared_sleep_end']
-    
+    df[abs_cols] = np.abs(diff)
+    df[signed_cols] = diff
+
     return df
 
+# Figures are kept open between calls so re-running the plots reuses them
+_FIG_CACHE = {}
+
+def _get_figure(name, nrows, ncols, figsize):
+    """
+    Return (fig, axes) for a cached figure, clearing the axes when it is reused.
+    """
+    if name in _FIG_CACHE:
+        fig, axes = _FIG_CACHE[name]
+        for ax in np.ravel(axes):
+            ax.clear()
+        return fig, axes
+
+    fig, axes = plt.subplots(nrows, ncols, figsize=figsize)
+    _FIG_CACHE[name] = (fig, axes)
+    return fig, axes
+
 def plot_comparisons(df):
     metrics = [
         ('sleep_start', 'sleeptime_start_oura', 'sleeptime_start_ultrahuman'),
         ('total_sleep', 'total_sleep_duration_oura', 'total_sleep_duration_ultrahuman'),
         ('sleep_end', 'sleeptime_end_oura', 'sleeptime_end_ultrahuman')
     ]
-    fig, axes = plt.subplots(3, 1, figsize=(12, 18))
-    fig.suptitle('Sleep Metrics Comparison: Anecdotal vs Oura vs Ultrahuman')
-
-    for i, (metric, oura_col, ultrahuman_col) in enumerate(metrics):
-        ax = axes[i]
-        ax.plot(df['Date'], df[f'jared_{metric}'], label='Anecdotal', marker='o')
-        ax.plot(df['Date'], df[oura_col], label='Oura', marker='s')
-        ax.plot(df['Date'], df[ultrahuman_col], label='Ultrahuman', marker='^')
-        ax.set_title(f'{metric.replace("_", " ").title()}')
-        ax.set_xlabel('Date')
-        ax.set_ylabel('Minutes')
-        ax.legend()
-        ax.grid(True)
-
-    plt.tight_layout()
-    plt.savefig('output/graphs/sleep_metrics_comparison.png')
-    plt.close()
+    # On reuse only the line data changes, so update the existing artists in place
+    if 'comparisons' in _FIG_CACHE:
+        fig, axes, lines = _FIG_CACHE['comparisons']
+        for i, (metric, oura_col, ultrahuman_col) in enumerate(metrics):
+            ydata_list = [df[f'jared_{metric}'], df[oura_col], df[ultrahuman_col]]
+            for line, ydata in zip(lines[i], ydata_list):
+                line.set_data(df['Date'], ydata)
+            axes[i].relim()
+            axes[i].autoscale_view()
+    else:
+        fig, axes = plt.subplots(3, 1, figsize=(12, 18))
+        fig.suptitle('Sleep Metrics Comparison: Anecdotal vs Oura vs Ultrahuman')
+
+        lines = []
+        for i, (metric, oura_col, ultrahuman_col) in enumerate(metrics):
+            ax = axes[i]
+            lines.append([
+                ax.plot(df['Date'], df[f'jared_{metric}'], label='Anecdotal', marker='o', rasterized=True)[0],
+                ax.plot(df['Date'], df[oura_col], label='Oura', marker='s', rasterized=True)[0],
+                ax.plot(df['Date'], df[ultrahuman_col], label='Ultrahuman', marker='^', rasterized=True)[0]
+            ])
+            ax.set_title(f'{metric.replace("_", " ").title()}')
+            ax.set_xlabel('Date')
+            ax.set_ylabel('Minutes')
+            ax.legend()
+            ax.grid(True)
+
+        fig.tight_layout()
+        _FIG_CACHE['comparisons'] = (fig, axes, lines)
+
+    fig.savefig('output/graphs/sleep_metrics_comparison.png', dpi=200)
 
 def plot_errors(df):
     metrics = ['sleep_start', 'total_sleep', 'sleep_end']
-    fig, axes = plt.subplots(3, 1, figsize=(15, 22))
+    fig, axes = _get_figure('errors', 3, 1, figsize=(15, 22))
     fig.suptitle('Error Comparison: Oura vs Ultrahuman', fontsize=24, y=0.95)
 
     for i, metric in enumerate(metrics):
         ax = axes[i]
-        ax.bar(df['Date'], df[f'{metric}_error_abs_oura'], width=0.4, align='edge', label='Oura Error')
-        ax.bar(df['Date'], df[f'{metric}_error_abs_ultrahuman'], width=-0.4, align='edge', label='Ultrahuman Error')
+        ax.bar(df['Date'], df[f'{metric}_error_abs_oura'], width=0.4, align='edge', label='Oura Error', rasterized=True)
+        ax.bar(df['Date'], df[f'{metric}_error_abs_ultrahuman'], width=-0.4, align='edge', label='Ultrahuman Error', rasterized=True)
         ax.set_title(f'{metric.replace("_", " ").title()} Error', fontsize=20)
         ax.set_xlabel('Date', fontsize=16)
         ax.set_ylabel('Minutes', fontsize=16)
@@ -114,15 +154,30 @@ def plot_errors(df):
         ax.set_xlim(df['Date'].min() - pd.Timedelta(days=0.5), 
                     df['Date'].max() + pd.Timedelta(days=0.5))
 
-    plt.tight_layout()
-    plt.subplots_adjust(top=0.92, hspace=0.3, bottom=0.1)
-    plt.savefig('output/graphs/error_comparison.png', dpi=300, bbox_inches='tight')
-    plt.close()
+    fig.tight_layout()
+    fig.subplots_adjust(top=0.92, hspace=0.3, bottom=0.1)
+    fig.savefig('output/graphs/error_comparison.png', dpi=300, bbox_inches='tight')
+
+def _plot_error_histogram(ax, data, bins, kde_grid, color):
+    """
+    Draw a count histogram of data on the given bins with a count-scaled KDE overlay.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    bin_size = bins[1] - bins[0]
+    counts, _ = np.histogram(data, bins=bins)
+    ax.bar(bins[:-1], counts, width=bin_size, align='edge', color=color, alpha=0.6,
+           edgecolor='white', rasterized=True)
+
+    # A KDE needs at least two distinct values
+    if len(data) > 1 and data.min() < data.max():
+        kde = gaussian_kde(data, bw_method='silverman')
+        grid = kde_grid[(kde_grid >= data.min()) & (kde_grid <= data.max())]
+        ax.plot(grid, kde(grid) * len(data) * bin_size, color=color, linewidth=2, rasterized=True)
 
 def plot_error_distributions(df):
     metrics = ['sleep_start', 'total_sleep', 'sleep_end']
     bin_sizes = {'sleep_start': 5, 'total_sleep': 10, 'sleep_end': 5}
-    fig, axes = plt.subplots(3, 2, figsize=(20, 24))
+    fig, axes = _get_figure('error_distributions', 3, 2, figsize=(20, 24))
     
     # Set the main title with even larger font size
     fig.suptitle('Error Distributions: Oura vs Ultrahuman', fontsize=34, y=0.95)
@@ -140,9 +195,10 @@ def plot_error_distributions(df):
         
         bin_size = bin_sizes[metric]
         bins = np.arange(x_min, x_max + bin_size, bin_size)
+        kde_grid = np.linspace(x_min, x_max, 128)
 
         # Plot Oura
-        sns.histplot(data=oura_data, ax=axes[i, 0], kde=True, color=oura_color, bins=bins)
+        _plot_error_histogram(axes[i, 0], oura_data, bins, kde_grid, oura_color)
         axes[i, 0].set_title(f'Oura {metric.replace("_", " ").title()} Error', fontsize=26)
         axes[i, 0].set_xlabel('Error (minutes)', fontsize=20)
         axes[i, 0].set_ylabel('Count', fontsize=20)
@@ -150,7 +206,7 @@ def plot_error_distributions(df):
         axes[i, 0].tick_params(axis='both', which='major', labelsize=20)
 
         # Plot Ultrahuman
-        sns.histplot(data=ultra_data, ax=axes[i, 1], kde=True, color=ultra_color, bins=bins)
+        _plot_error_histogram(axes[i, 1], ultra_data, bins, kde_grid, ultra_color)
         axes[i, 1].set_title(f'Ultrahuman {metric.replace("_", " ").title()} Error', fontsize=26)
         axes[i, 1].set_xlabel('Error (minutes)', fontsize=20)
         axes[i, 1].set_ylabel('Count', fontsize=20)
@@ -165,57 +221,49 @@ def plot_error_distributions(df):
         axes[i, 0].yaxis.set_major_locator(plt.MaxNLocator(integer=True))
         axes[i, 1].yaxis.set_major_locator(plt.MaxNLocator(integer=True))
 
-    plt.tight_layout()
+    fig.tight_layout()
     # Adjust the layout to accommodate the larger main title
-    plt.subplots_adjust(top=0.90, hspace=0.24)
-    plt.savefig('output/graphs/error_distributions.png', dpi=300)
-    plt.close()
+    fig.subplots_adjust(top=0.90, hspace=0.24)
+    fig.savefig('output/graphs/error_distributions.png', dpi=300)
 
 def plot_error_direction(df):
-    # Prepare the data
+    # Prepare the data as columns: for each metric, all Oura errors followed by all Ultrahuman errors
     metrics = ['sleep_start', 'total_sleep', 'sleep_end']
-    plot_data = []
-
-    for metric in metrics:
-        oura_errors = df[f'{metric}_error_oura']
-        ultra_errors = df[f'{metric}_error_ultrahuman']
-        
-        plot_data.extend([
-            {'Metric': metric.replace('_', ' ').title(), 'Device': 'Oura', 'Error': error}
-            for error in oura_errors
-        ])
-        plot_data.extend([
-            {'Metric': metric.replace('_', ' ').title(), 'Device': 'Ultrahuman', 'Error': error}
-            for error in ultra_errors
-        ])
-
-    plot_df = pd.DataFrame(plot_data)
-
-    # Create the plot
-    plt.figure(figsize=(15, 10))
-    sns.set_style("whitegrid")
+    metric_names = [metric.replace('_', ' ').title() for metric in metrics]
+    devices = ['Oura', 'Ultrahuman']
+    n = len(df)
+
+    errors = np.concatenate([df[f'{metric}_error_{device.lower()}'].to_numpy() for metric in metrics for device in devices])
+    plot_df = pd.DataFrame({
+        'Metric': pd.Categorical(np.repeat(metric_names, len(devices) * n), categories=metric_names),
+        'Device': pd.Categorical(np.tile(np.repeat(devices, n), len(metrics)), categories=devices),
+        'Error': errors
+    })
+
+    # Create the plot; the style only needs to be in effect when the axes are first created
+    with sns.axes_style("whitegrid"):
+        fig, ax = _get_figure('error_direction', 1, 1, figsize=(15, 10))
     
-    ax = sns.violinplot(x='Metric', y='Error', hue='Device', data=plot_df, 
-                        split=True, inner="quartile", cut=0)
+    sns.violinplot(x='Metric', y='Error', hue='Device', data=plot_df, ax=ax,
+                   split=True, inner="quartile", cut=0, rasterized=True)
 
     # Customize the plot
-    plt.title('Error Direction and Magnitude: Oura vs Ultrahuman', fontsize=20)
-    plt.xlabel('Metric', fontsize=16)
-    plt.ylabel('Error (minutes)', fontsize=16)
-    plt.axhline(y=0, color='r', linestyle='--')  # Add a line at y=0 for reference
+    ax.set_title('Error Direction and Magnitude: Oura vs Ultrahuman', fontsize=20)
+    ax.set_xlabel('Metric', fontsize=16)
+    ax.set_ylabel('Error (minutes)', fontsize=16)
+    ax.axhline(y=0, color='r', linestyle='--')  # Add a line at y=0 for reference
 
     # Adjust legend and labels
-    plt.legend(title='Device', fontsize=12, title_fontsize=14)
-    plt.xticks(fontsize=14)
-    plt.yticks(fontsize=12)
+    ax.legend(title='Device', fontsize=12, title_fontsize=14)
+    ax.tick_params(axis='x', labelsize=14)
+    ax.tick_params(axis='y', labelsize=12)
 
     # Add annotations
-    plt.text(0.02, 0.98, 'Above 0: Overestimation', transform=ax.transAxes, fontsize=12, va='top')
-    plt.text(0.02, 0.02, 'Below 0: Underestimation', transform=ax.transAxes, fontsize=12, va='bottom')
+    ax.text(0.02, 0.98, 'Above 0: Overestimation', transform=ax.transAxes, fontsize=12, va='top')
+    ax.text(0.02, 0.02, 'Below 0: Underestimation', transform=ax.transAxes, fontsize=12, va='bottom')
 
-    plt.tight_layout()
-    plt.savefig('output/graphs/error_direction.png', dpi=300)
-    plt.close()
+    fig.tight_layout()
+    fig.savefig('output/graphs/error_direction.png', dpi=300)
 
 
 if __name__ == '__main__':
@@ -227,7 +275,8 @@ if __name__ == '__main__':
     # Anecdotal data
     anecdotal_data_df = pd.read_csv("anecdotal_sleep_data.csv")
     anecdotal_data_df['Date'] = pd.to_datetime(anecdotal_data_df['Date'], format='%m/%d/%Y')
-    anecdotal_data_df = anecdotal_data_df[~anecdotal_data_df['Date'].dt.strftime('%Y-%m-%d').isin(DATES_TO_EXCLUDE)]
+    excluded_dates = pd.to_datetime(DATES_TO_EXCLUDE).values.astype('datetime64[D]')
+    anecdotal_data_df = anecdotal_data_df[~np.isin(anecdotal_data_df['Date'].values.astype('datetime64[D]'), excluded_dates)]
 
     oura_data, ultrahuman_data = fetch_and_process_data(start_date, end_date, DATES_TO_EXCLUDE)
     merged_df = create_dataframes(oura_data, ultrahuman_data, anecdotal_data_df)
@@ -1,11 +1,35 @@
 import os
 import requests
-from datetime import datetime, timedelta, date
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
+from datetime import timedelta, date
 import csv
-from tabulate import tabulate
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to the NumPy implementation
+    njit = None
 
 ACCESS_TOKEN = os.environ['OURA_ACCESS_TOKEN']
 
+# Shared session so repeated calls reuse the pooled keep-alive connection
+_SESSION = requests.Session()
+_SESSION.headers.update({"Authorization": f"Bearer {ACCESS_TOKEN}"})
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                      raise_on_status=False)
+))
+
+PHASE_DURATION = 5  # Each phase represents 5 minutes
+
+# Integer-minute columns returned by process_sleep_data, in output order after 'day'
+MINUTE_COLUMNS = ['bedtime_start', 'bedtime_end', 'sleeptime_start', 'sleeptime_end',
+                  'deep_sleep_duration', 'awake_time_filtered_phases', 'awake_time_filtered_subtraction',
+                  'light_sleep_duration', 'rem_sleep_duration', 'total_sleep_duration']
+
 def get_oura_sleep_data(start_date, end_date=None, dates_to_exclude=[]):
     """
     Fetch Oura sleep data for a specified date range.
@@ -27,87 +51,150 @@ def get_oura_sleep_data(start_date, end_date=None, dates_to_exclude=[]):
         end_date = date.fromisoformat(end_date)
     
     base_url = "https://api.ouraring.com/v2/usercollection/sleep"
-    headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
     params = {
         "start_date": start_date.isoformat(),
         "end_date": (end_date + timedelta(days=1)).isoformat()
     }
 
-    response = requests.get(base_url, headers=headers, params=params)
+    response = _SESSION.get(base_url, params=params, timeout=10)
     if response.status_code == 200:
         data = response.json()['data']
 
         # Grouping and filtering by day to keep only the longest session
-        sleep_data_by_day = {}
+        exclude = set(dates_to_exclude)
+        best_by_day = {}
         for session in data:
             day = session['day']
-            if day not in dates_to_exclude:
-                total_sleep_duration = session['deep_sleep_duration'] + session['light_sleep_duration'] + session['rem_sleep_duration'] if 'rem_sleep_duration' in session else 0
-                if day not in sleep_data_by_day or total_sleep_duration > sleep_data_by_day[day]['total_sleep_duration']:
-                    sleep_data_by_day[day] = session
-                    sleep_data_by_day[day]['total_sleep_duration'] = total_sleep_duration
+            if day in exclude:
+                continue
+            total_sleep_duration = (session.get('deep_sleep_duration', 0)
+                                    + session.get('light_sleep_duration', 0)
+                                    + session.get('rem_sleep_duration', 0))
+            previous = best_by_day.get(day)
+            if previous is None or total_sleep_duration > previous[0]:
+                best_by_day[day] = (total_sleep_duration, session)
 
         # Convert the dictionary back to a sorted list
-        filtered_data = sorted(sleep_data_by_day.values(), key=lambda x: x['day'])
+        filtered_data = [dict(session, total_sleep_duration=total_sleep_duration)
+                         for total_sleep_duration, session in sorted(best_by_day.values(), key=lambda x: x[1]['day'])]
         return filtered_data
     else:
         raise Exception(f"Failed to fetch data: {response.status_code}")
 
+def _sleep_window_numpy(sleep_phases, bedtime_start, bedtime_end, total_awake_time):
+    """
+    Derive sleeptime_start, sleeptime_end and the filtered awake times from a night's phases.
+
+    Sleep starts at the first and ends after the last non-awake (!= 4) phase. Returns
+    (sleeptime_start, sleeptime_end, awake_time_filtered_phases, awake_time_filtered_subtraction).
+    """
+    asleep = sleep_phases != 4
+    if asleep.any():
+        start_index = int(asleep.argmax())
+        end_index = len(sleep_phases) - 1 - int(asleep[::-1].argmax())
+        sleeptime_start = bedtime_start + start_index * PHASE_DURATION
+        sleeptime_end = bedtime_start + (end_index + 1) * PHASE_DURATION
+        awake_time_filtered_phases = int((sleep_phases[start_index:end_index + 1] == 4).sum()) * PHASE_DURATION
+    else:
+        sleeptime_start = bedtime_start
+        sleeptime_end = bedtime_start + len(sleep_phases) * PHASE_DURATION
+        awake_time_filtered_phases = 0
+
+    trimmed_time = (sleeptime_start - bedtime_start) + (bedtime_end - sleeptime_end)
+    awake_time_filtered_subtraction = max(0, total_awake_time - trimmed_time)
+    return sleeptime_start, sleeptime_end, awake_time_filtered_phases, awake_time_filtered_subtraction
+
+def _sleep_window_loop(sleep_phases, bedtime_start, bedtime_end, total_awake_time):
+    """
+    Single forward pass equivalent of _sleep_window_numpy, compiled with numba when available.
+    """
+    start_index = -1
+    end_index = -1
+    awake_phases = 0
+    pending_awake = 0  # awake phases seen since the last non-awake phase
+    for i in range(len(sleep_phases)):
+        if sleep_phases[i] == 4:
+            pending_awake += 1
+        else:
+            if start_index == -1:
+                start_index = i
+            else:
+                awake_phases += pending_awake
+            pending_awake = 0
+            end_index = i
+
+    if start_index == -1:
+        sleeptime_start = bedtime_start
+        sleeptime_end = bedtime_start + len(sleep_phases) * PHASE_DURATION
+    else:
+        sleeptime_start = bedtime_start + start_index * PHASE_DURATION
+        sleeptime_end = bedtime_start + (end_index + 1) * PHASE_DURATION
+
+    trimmed_time = (sleeptime_start - bedtime_start) + (bedtime_end - sleeptime_end)
+    awake_time_filtered_subtraction = max(0, total_awake_time - trimmed_time)
+    return sleeptime_start, sleeptime_end, awake_phases * PHASE_DURATION, awake_time_filtered_subtraction
+
+_sleep_window = njit(cache=True)(_sleep_window_loop) if njit is not None else _sleep_window_numpy
+
 def process_sleep_data(sleep_data_list, dates_to_exclude=[]):
+    """
+    Process raw Oura sleep sessions into per-night minute metrics.
+
+    Returns:
+    dict: Column name -> numpy array, one element per night ('day' plus MINUTE_COLUMNS).
+    """
     def time_to_minutes(time_str):
-        time = datetime.fromisoformat(time_str)
-        minutes = time.hour * 60 + time.minute
-        if time.hour < 12:
+        # ISO-8601 timestamps ('YYYY-MM-DDTHH:MM:SS...') have fixed hour/minute offsets
+        hour = int(time_str[11:13])
+        minutes = hour * 60 + int(time_str[14:16])
+        if hour < 12:
             minutes += 24 * 60  # Add 24 hours if it's AM
         return minutes - 24 * 60  # Subtract 24 hours to get the correct range
 
     def parse_sleep_phases(sleep_phase_str):
-        return [int(phase) for phase in sleep_phase_str]
-
-    processed_data = []
-
-    for sleep_data in sleep_data_list:
-        if sleep_data['day'] not in dates_to_exclude:
-            # Rest of the processing code remains the same
-            bedtime_start = time_to_minutes(sleep_data['bedtime_start'])
-            bedtime_end = time_to_minutes(sleep_data['bedtime_end'])
-
-            # Process sleep phases
-            sleep_phases = parse_sleep_phases(sleep_data['sleep_phase_5_min'])
-            phase_duration = 5  # Each phase represents 5 minutes
-
-            # Find sleeptime_start
-            start_index = next((i for i, phase in enumerate(sleep_phases) if phase != 4), None)
-            sleeptime_start = bedtime_start + (start_index * phase_duration if start_index is not None else 0)
-
-            # Find sleeptime_end
-            end_index = next((len(sleep_phases) - i - 1 for i, phase in enumerate(reversed(sleep_phases)) if phase != 4), None)
-            sleeptime_end = bedtime_start + ((end_index + 1) * phase_duration if end_index is not None else len(sleep_phases) * phase_duration)
-
-            # Calculate awake_time_filtered using both methods
-            awake_time_filtered_phases = sum(1 for phase in sleep_phases[start_index:end_index+1] if phase == 4) * phase_duration
-            
-            total_awake_time = sleep_data['awake_time'] // 60  # Convert to minutes
-            trimmed_time = (sleeptime_start - bedtime_start) + (bedtime_end - sleeptime_end)
-            awake_time_filtered_subtraction = max(0, total_awake_time - trimmed_time)
-
-            processed_entry = {
-                'day': sleep_data['day'],
-                'bedtime_start': bedtime_start,
-                'bedtime_end': bedtime_end,
-                'sleeptime_start': sleeptime_start,
-                'sleeptime_end': sleeptime_end,
-                'deep_sleep_duration': sleep_data['deep_sleep_duration'] // 60,
-                'awake_time_filtered_phases': awake_time_filtered_phases,
-                'awake_time_filtered_subtraction': awake_time_filtered_subtraction,
-                'light_sleep_duration': sleep_data['light_sleep_duration'] // 60,
-                'rem_sleep_duration': sleep_data['rem_sleep_duration'] // 60,
-                'total_sleep_duration': sleep_data['total_sleep_duration'] // 60
-            }
-            processed_data.append(processed_entry)
+        # Phases are ASCII digits, so view the bytes as uint8 and subtract '0'
+        return np.frombuffer(sleep_phase_str.encode('ascii'), dtype=np.uint8) - np.uint8(ord('0'))
+
+    sleep_data_list = [sleep_data for sleep_data in sleep_data_list if sleep_data['day'] not in dates_to_exclude]
+
+    # Fill one preallocated array per column so the result converts to a DataFrame without reshaping
+    n = len(sleep_data_list)
+    processed_data = {'day': np.empty(n, dtype='datetime64[D]')}
+    processed_data.update((col, np.empty(n, dtype=np.int32)) for col in MINUTE_COLUMNS)
+
+    for i, sleep_data in enumerate(sleep_data_list):
+        bedtime_start = time_to_minutes(sleep_data['bedtime_start'])
+        bedtime_end = time_to_minutes(sleep_data['bedtime_end'])
+
+        # Process sleep phases
+        sleep_phases = parse_sleep_phases(sleep_data['sleep_phase_5_min'])
+        total_awake_time = sleep_data['awake_time'] // 60  # Convert to minutes
+
+        # Find sleeptime_start/sleeptime_end and calculate awake_time_filtered using both methods
+        (sleeptime_start, sleeptime_end,
+         awake_time_filtered_phases, awake_time_filtered_subtraction) = _sleep_window(
+            sleep_phases, bedtime_start, bedtime_end, total_awake_time)
+
+        processed_data['day'][i] = sleep_data['day']
+        processed_data['bedtime_start'][i] = bedtime_start
+        processed_data['bedtime_end'][i] = bedtime_end
+        processed_data['sleeptime_start'][i] = sleeptime_start
+        processed_data['sleeptime_end'][i] = sleeptime_end
+        processed_data['deep_sleep_duration'][i] = sleep_data['deep_sleep_duration'] // 60
+        processed_data['awake_time_filtered_phases'][i] = awake_time_filtered_phases
+        processed_data['awake_time_filtered_subtraction'][i] = awake_time_filtered_subtraction
+        processed_data['light_sleep_duration'][i] = sleep_data['light_sleep_duration'] // 60
+        processed_data['rem_sleep_duration'][i] = sleep_data['rem_sleep_duration'] // 60
+        processed_data['total_sleep_duration'][i] = sleep_data['total_sleep_duration'] // 60
 
     return processed_data
 
+def iter_sleep_data_rows(processed_data):
+    """
+    Yield (day, *minute columns) tuples from the columnar output of process_sleep_data.
+    """
+    return zip(processed_data['day'], *(processed_data[col] for col in MINUTE_COLUMNS))
+
 def print_formatted_sleep_data(processed_data):
     """
     Print the processed sleep data in a formatted table.
@@ -115,24 +202,16 @@ def print_formatted_sleep_data(processed_data):
     headers = ["Day", "Bedtime Start", "Bedtime End", "Sleep Start", "Sleep End", 
                "Deep Sleep", "Awake (Phases)", "Awake (Subtraction)", "Light Sleep", "REM Sleep", "Total Sleep"]
     
-    table_data = []
-    for entry in processed_data:
-        row = [
-            entry['day'],
-            f"{entry['bedtime_start']} min",
-            f"{entry['bedtime_end']} min",
-            f"{entry['sleeptime_start']} min",
-            f"{entry['sleeptime_end']} min",
-            f"{entry['deep_sleep_duration']} min",
-            f"{entry['awake_time_filtered_phases']} min",
-            f"{entry['awake_time_filtered_subtraction']} min",
-            f"{entry['light_sleep_duration']} min",
-            f"{entry['rem_sleep_duration']} min",
-            f"{entry['total_sleep_duration']} min"
-        ]
-        table_data.append(row)
-    
-    print(tabulate(table_data, headers=headers, tablefmt="grid"))
+    table_data = [(str(day), *(f"{value} min" for value in minutes))
+                  for day, *minutes in iter_sleep_data_rows(processed_data)]
+
+    # Fixed-width columns, left aligned, with a single rule under the header
+    widths = [max([len(header)] + [len(row[i]) for row in table_data]) for i, header in enumerate(headers)]
+    row_format = " | ".join(f"{{:<{width}}}" for width in widths)
+    print(row_format.format(*headers))
+    print("-" * (sum(widths) + 3 * (len(widths) - 1)))
+    for row in table_data:
+        print(row_format.format(*row))
 
 def save_sleep_data_to_csv(processed_data, filename="csv/oura_sleep_data.csv"):
     """
@@ -141,23 +220,10 @@ def save_sleep_data_to_csv(processed_data, filename="csv/oura_sleep_data.csv"):
     with open(filename, 'w', newline='') as csvfile:
         fieldnames = ["Day", "Bedtime Start", "Bedtime End", "Sleep Start", "Sleep End", 
                       "Deep Sleep", "Awake (Phases)", "Awake (Subtraction)", "Light Sleep", "REM Sleep", "Total Sleep"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.writer(csvfile)
         
-        writer.writeheader()
-        for entry in processed_data:
-            writer.writerow({
-                "Day": entry['day'],
-                "Bedtime Start": entry['bedtime_start'],
-                "Bedtime End": entry['bedtime_end'],
-                "Sleep Start": entry['sleeptime_start'],
-                "Sleep End": entry['sleeptime_end'],
-                "Deep Sleep": entry['deep_sleep_duration'],
-                "Awake (Phases)": entry['awake_time_filtered_phases'],
-                "Awake (Subtraction)": entry['awake_time_filtered_subtraction'],
-                "Light Sleep": entry['light_sleep_duration'],
-                "REM Sleep": entry['rem_sleep_duration'],
-                "Total Sleep": entry['total_sleep_duration']
-            })
+        writer.writerow(fieldnames)
+        writer.writerows(iter_sleep_data_rows(processed_data))
     print(f"Sleep data saved to {filename}")
 
 
@@ -1,13 +1,120 @@
+import asyncio
+import time
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
+from pathlib import Path
 import csv
-from tabulate import tabulate
+from operator import itemgetter
 
-def get_ultrahuman_sleep_data(start_date, end_date=None, dates_to_exclude=[]):
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional; the stdlib parser accepts the same bytes
+    import json
+    _loads = json.loads
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is optional; fall back to fetching one date at a time
+    aiohttp = None
+
+URL = "https://partner.ultrahuman.com/api/v1/metrics"
+
+MAX_CONCURRENT_REQUESTS = 5  # Keeps concurrent fetches under the partner API's rate limit
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.3
+
+# Sleep graph JSON compresses well, so always ask for a compressed response
+ACCEPT_ENCODING = "gzip, deflate"
+
+_encoding_checked = False
+
+def _check_content_encoding(status, content_encoding):
+    """
+    Report once if a successful response arrived uncompressed despite ACCEPT_ENCODING.
+    """
+    global _encoding_checked
+    if status != 200 or _encoding_checked:
+        return
+    _encoding_checked = True
+    if content_encoding not in ("gzip", "deflate"):
+        print(f"Ultrahuman response was not compressed (Content-Encoding: {content_encoding})")
+
+_session = None
+
+def _cache_dir():
+    """
+    Directory for cached raw responses, or None when ULTRAHUMAN_CACHE_DIR is set to an empty string.
+    """
+    cache_dir = os.environ.get("ULTRAHUMAN_CACHE_DIR", str(Path.home() / ".cache" / "ultrahuman"))
+    if not cache_dir:
+        return None
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+def get_session():
+    """
+    Return the shared requests.Session used for sequential fetches, creating it on first use.
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        _session.mount("https://", HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=4,
+            max_retries=Retry(total=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=RETRY_STATUSES,
+                              raise_on_status=False)
+        ))
+    return _session
+
+async def _fetch_async(session, semaphore, params):
+    """
+    Fetch one date, retrying rate-limited and 5xx responses with exponential backoff.
+    """
+    async with semaphore:
+        for attempt in range(MAX_RETRIES + 1):
+            async with session.get(URL, params=params) as response:
+                if response.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    _check_content_encoding(response.status, response.headers.get("Content-Encoding"))
+                    return response.status, await response.read()
+            await asyncio.sleep(BACKOFF_FACTOR * 2 ** attempt)
+
+async def _fetch_all_async(headers, params_list):
+    """
+    Fetch every date concurrently over one pooled keep-alive connector, preserving order.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS)
+    headers = {**headers, "Accept-Encoding": ACCEPT_ENCODING}
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+        return await asyncio.gather(*(_fetch_async(session, semaphore, params) for params in params_list))
+
+def _fetch_all_sync(headers, params_list):
+    session = get_session()
+    results = []
+    for params in params_list:
+        response = session.get(URL, headers=headers, params=params, timeout=30)
+        _check_content_encoding(response.status_code, response.headers.get("Content-Encoding"))
+        results.append((response.status_code, response.content))
+    return results
+
+def get_ultrahuman_sleep_data(start_date, end_date=None, dates_to_exclude=None):
+    """
+    Fetch Ultrahuman sleep data for a specified date range.
+
+    Yields the sleep metric payload for each date as it is parsed, so callers can process
+    one night at a time instead of holding every parsed response in memory.
+    """
+    exclude_set = frozenset(dates_to_exclude or ())
     AUTH_TOKEN = os.environ["ULTRAHUMAN_AUTHORIZATION_TOKEN"]
     USER_EMAIL = os.environ["ULTRAHUMAN_EMAIL"]
-    url = "https://partner.ultrahuman.com/api/v1/metrics"
     headers = {"Authorization": AUTH_TOKEN}
 
     if end_date is None:
@@ -15,109 +122,161 @@ def get_ultrahuman_sleep_data(start_date, end_date=None, dates_to_exclude=[]):
 
     start_date = datetime.fromisoformat(start_date)
     end_date = datetime.fromisoformat(end_date)
-    
-    sleep_data_list = []
 
+    dates = []
     current_date = start_date
     while current_date <= end_date:
-        if current_date.date().isoformat() not in dates_to_exclude:
-            params = {
-                "email": USER_EMAIL,
-                "date": current_date.isoformat()
-            }
+        if current_date.date().isoformat() not in exclude_set:
+            dates.append(current_date)
+        current_date += timedelta(days=1)
 
-            response = requests.get(url, headers=headers, params=params)
+    # Completed days never change, so their raw responses are served from the on-disk cache
+    cache_dir = _cache_dir()
+    today = date.today()
+    cache_paths = [
+        cache_dir / f"{USER_EMAIL}_{current_date.date()}.json"
+        if cache_dir is not None and current_date.date() < today else None
+        for current_date in dates
+    ]
+    responses = [(200, path.read_bytes()) if path is not None and path.exists() else None for path in cache_paths]
 
-            if response.status_code == 200:
-                sleep_data = response.json()['data']['metric_data'][6]
-                sleep_data_list.append(sleep_data)
-            else:
-                print(f"Error retrieving Ultrahuman data for {current_date.isoformat()}: {response.status_code}")
-                print(response.text)
+    missing = [i for i, response in enumerate(responses) if response is None]
+    params_list = [{"email": USER_EMAIL, "date": dates[i].isoformat()} for i in missing]
+    if aiohttp is not None:
+        fetched = asyncio.run(_fetch_all_async(headers, params_list))
+    else:
+        fetched = _fetch_all_sync(headers, params_list)
 
-        current_date += timedelta(days=1)
+    for i, (status, content) in zip(missing, fetched):
+        responses[i] = (status, content)
+        if status == 200 and cache_paths[i] is not None:
+            cache_paths[i].write_bytes(content)
 
-    return sleep_data_list
+    for current_date, (status, content) in zip(dates, responses):
+        if status == 200:
+            yield _loads(content)['data']['metric_data'][6]
+        else:
+            print(f"Error retrieving Ultrahuman data for {current_date.isoformat()}: {status}")
+            print(content.decode(errors='replace'))
+
+def _local_wall_seconds(timestamps):
+    """
+    Shift unix timestamps by the local UTC offset in effect at each instant (naive local time as seconds).
+    """
+    offsets = np.fromiter((time.localtime(ts).tm_gmtoff for ts in timestamps.ravel().tolist()),
+                          dtype=np.int64, count=timestamps.size)
+    return timestamps + offsets.reshape(timestamps.shape)
 
-def process_ultrahuman_sleep_data(sleep_data_list, dates_to_exclude=[]):
+def process_ultrahuman_sleep_data(sleep_data_iter, dates_to_exclude=None):
+    exclude_set = frozenset(dates_to_exclude or ())
     processed_data = []
     daily_sleep_data = {}
 
-    print(f"Total sleep data entries: {len(sleep_data_list)}")
-
-    def time_to_minutes(dt, reference_date):
-        delta = dt - reference_date
-        return delta.days * 24 * 60 + delta.seconds // 60
-
-    for sleep_data in sleep_data_list:
-        bedtime_start = datetime.fromtimestamp(sleep_data['object']['bedtime_start'])
-        bedtime_end = datetime.fromtimestamp(sleep_data['object']['bedtime_end'])
-        day = bedtime_end.date().isoformat()  # Use the end date as the key
+    # Entries are consumed as they arrive; only the longest session seen so far is kept per day
+    entry_count = 0
+    for sleep_data in sleep_data_iter:
+        entry_count += 1
+        bedtime_start = sleep_data['object']['bedtime_start']
+        bedtime_end = sleep_data['object']['bedtime_end']
+        local_end = time.localtime(bedtime_end)
+        day = time.strftime('%Y-%m-%d', local_end)  # Use the end date as the key
         
-        if day not in dates_to_exclude:
-            reference_date = bedtime_end.replace(hour=0, minute=0, second=0, microsecond=0)
-            
+        if day not in exclude_set:
             # If we haven't seen this day before, or if this sleep session is longer than the previous one
-            if day not in daily_sleep_data or (bedtime_end - bedtime_start) > daily_sleep_data[day]['duration']:
+            duration = bedtime_end - bedtime_start
+            if day not in daily_sleep_data or duration > daily_sleep_data[day]['duration']:
+                # Local midnight of that date, in the same wall-clock seconds as _local_wall_seconds
+                wall_end = int(bedtime_end) + local_end.tm_gmtoff
                 daily_sleep_data[day] = {
                     'data': sleep_data,
-                    'duration': bedtime_end - bedtime_start,
-                    'reference_date': reference_date
+                    'duration': duration,
+                    'bedtime_start': bedtime_start,
+                    'bedtime_end': bedtime_end,
+                    'reference_ts': wall_end - wall_end % 86400
                 }
 
-    for day, day_sleep_data in daily_sleep_data.items():
-        # Rest of the processing code remains the same
-        sleep_data = day_sleep_data['data']
-        reference_date = day_sleep_data['reference_date']
-        bedtime_start = datetime.fromtimestamp(sleep_data['object']['bedtime_start'])
-        bedtime_end = datetime.fromtimestamp(sleep_data['object']['bedtime_end'])
+    print(f"Total sleep data entries: {entry_count}")
+
+    # Gather the per-night raw values (unix seconds) column by column, then convert them with array ops
+    days = []
+    reference_ts = []
+    timestamps = []  # rows of (bedtime_start, bedtime_end, sleeptime_start, sleeptime_end)
+    stage_seconds = []  # rows of (deep, light, rem, total, awake_filtered)
 
-        bedtime_start_minutes = time_to_minutes(bedtime_start, reference_date)
-        bedtime_end_minutes = time_to_minutes(bedtime_end, reference_date)
+    # ISO date keys sort chronologically, so visiting them in order leaves nothing to sort afterwards
+    for day in sorted(daily_sleep_data):
+        day_sleep_data = daily_sleep_data[day]
+        sleep_data = day_sleep_data['data']
+        bedtime_start = day_sleep_data['bedtime_start']
+        bedtime_end = day_sleep_data['bedtime_end']
 
         sleep_stages = sleep_data['object']['sleep_stages']
-        deep_sleep = next((stage for stage in sleep_stages if stage['type'] == 'deep_sleep'), {'stage_time': 0})
-        light_sleep = next((stage for stage in sleep_stages if stage['type'] == 'light_sleep'), {'stage_time': 0})
-        rem_sleep = next((stage for stage in sleep_stages if stage['type'] == 'rem_sleep'), {'stage_time': 0})
-        awake = next((stage for stage in sleep_stages if stage['type'] == 'awake'), {'stage_time': 0})
+        stage_times = {stage['type']: stage['stage_time'] for stage in sleep_stages}
+        awake = stage_times.get('awake', 0)
 
         sleep_graph = sleep_data['object']['sleep_graph']['data']
-        non_awake_segments = [segment for segment in sleep_graph if segment['type'] != 'awake']
+
+        # One walk over the graph: track the non-awake bounds and set aside awake (start, end) pairs
+        min_start = None
+        max_end = None
+        awake_segments = []
+        for segment in sleep_graph:
+            start = segment['start']
+            end = segment['end']
+            if segment['type'] == 'awake':
+                awake_segments.append((start, end))
+            else:
+                if min_start is None or start < min_start:
+                    min_start = start
+                if max_end is None or end > max_end:
+                    max_end = end
         
-        if non_awake_segments:
-            sleeptime_start = datetime.fromtimestamp(min(segment['start'] for segment in non_awake_segments))
-            sleeptime_end = datetime.fromtimestamp(max(segment['end'] for segment in non_awake_segments))
-            
-            sleeptime_start_minutes = time_to_minutes(sleeptime_start, reference_date)
-            sleeptime_end_minutes = time_to_minutes(sleeptime_end, reference_date)
-
-            awake_time_filtered = sum(
-                segment['end'] - segment['start'] 
-                for segment in sleep_graph 
-                if segment['type'] == 'awake' and sleeptime_start.timestamp() <= segment['start'] < sleeptime_end.timestamp()
-            ) // 60  # Convert to minutes
+        if min_start is not None:
+            # Only awake time that starts inside the sleep window counts
+            awake_time_filtered = sum(end - start for start, end in awake_segments if min_start <= start < max_end)
         else:
-            sleeptime_start_minutes = bedtime_start_minutes
-            sleeptime_end_minutes = bedtime_end_minutes
+            min_start = bedtime_start
+            max_end = bedtime_end
             awake_time_filtered = 0
 
-        processed_entry = {
+        days.append(day)
+        reference_ts.append(day_sleep_data['reference_ts'])
+        timestamps.append((bedtime_start, bedtime_end, min_start, max_end))
+        stage_seconds.append((
+            stage_times.get('deep_sleep', 0),
+            stage_times.get('light_sleep', 0),
+            stage_times.get('rem_sleep', 0),
+            sum(stage_times.values()) - awake,
+            awake_time_filtered
+        ))
+
+    # Minutes are measured from local midnight of the day bedtime ends, in local wall-clock time
+    wall_seconds = _local_wall_seconds(np.array(timestamps, dtype=np.int64).reshape(-1, 4))
+    minutes = (wall_seconds - np.array(reference_ts, dtype=np.int64)[:, None]) // 60
+    durations = np.array(stage_seconds, dtype=np.int64).reshape(-1, 5) // 60
+
+    for day, (bs, be, ss, se), (deep, light, rem, total, awake_filtered) in zip(days, minutes.tolist(), durations.tolist()):
+        processed_data.append({
             'day': day,
-            'bedtime_start': bedtime_start_minutes,
-            'bedtime_end': bedtime_end_minutes,
-            'sleeptime_start': sleeptime_start_minutes,
-            'sleeptime_end': sleeptime_end_minutes,
-            'deep_sleep_duration': deep_sleep['stage_time'] // 60,
-            'awake_time_filtered': awake_time_filtered,
-            'light_sleep_duration': light_sleep['stage_time'] // 60,
-            'rem_sleep_duration': rem_sleep['stage_time'] // 60,
-            'total_sleep_duration': sum(stage['stage_time'] for stage in sleep_stages if stage['type'] != 'awake') // 60
-        }
-        processed_data.append(processed_entry)
-
-    return sorted(processed_data, key=lambda x: x['day'])
+            'bedtime_start': bs,
+            'bedtime_end': be,
+            'sleeptime_start': ss,
+            'sleeptime_end': se,
+            'deep_sleep_duration': deep,
+            'awake_time_filtered': awake_filtered,
+            'light_sleep_duration': light,
+            'rem_sleep_duration': rem,
+            'total_sleep_duration': total
+        })
+
+    return processed_data
     
 
+# Extracts a processed entry's fields in table/CSV column order
+_get_row = itemgetter('day', 'bedtime_start', 'bedtime_end', 'sleeptime_start', 'sleeptime_end',
+                      'deep_sleep_duration', 'awake_time_filtered', 'light_sleep_duration',
+                      'rem_sleep_duration', 'total_sleep_duration')
+
 def print_formatted_sleep_data(processed_data):
     """
     Print the processed sleep data in a formatted table.
@@ -125,23 +284,16 @@ def print_formatted_sleep_data(processed_data):
     headers = ["Day", "Bedtime Start", "Bedtime End", "Sleep Start", "Sleep End", 
                "Deep Sleep", "Awake (Filtered)", "Light Sleep", "REM Sleep", "Total Sleep"]
     
-    table_data = []
-    for entry in processed_data:
-        row = [
-            entry['day'],
-            f"{entry['bedtime_start']} min",
-            f"{entry['bedtime_end']} min",
-            f"{entry['sleeptime_start']} min",
-            f"{entry['sleeptime_end']} min",
-            f"{entry['deep_sleep_duration']} min",
-            f"{entry['awake_time_filtered']} min",
-            f"{entry['light_sleep_duration']} min",
-            f"{entry['rem_sleep_duration']} min",
-            f"{entry['total_sleep_duration']} min"
-        ]
-        table_data.append(row)
-    
-    print(tabulate(table_data, headers=headers, tablefmt="grid"))
+    table_data = [(day, *(f"{value} min" for value in minutes))
+                  for day, *minutes in map(_get_row, processed_data)]
+
+    # Fixed-width columns, left aligned, with a single rule under the header
+    widths = [max([len(header)] + [len(row[i]) for row in table_data]) for i, header in enumerate(headers)]
+    row_format = " | ".join(f"{{:<{width}}}" for width in widths)
+    print(row_format.format(*headers))
+    print("-" * (sum(widths) + 3 * (len(widths) - 1)))
+    for row in table_data:
+        print(row_format.format(*row))
 
 def save_sleep_data_to_csv(processed_data, filename="ultrahuman_sleep_data.csv"):
     """
@@ -150,22 +302,10 @@ def save_sleep_data_to_csv(processed_data, filename="ultrahuman_sleep_data.csv")
     with open(filename, 'w', newline='') as csvfile:
         fieldnames = ["Day", "Bedtime Start", "Bedtime End", "Sleep Start", "Sleep End", 
                       "Deep Sleep", "Awake (Filtered)", "Light Sleep", "REM Sleep", "Total Sleep"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.writer(csvfile)
         
-        writer.writeheader()
-        for entry in processed_data:
-            writer.writerow({
-                "Day": entry['day'],
-                "Bedtime Start": entry['bedtime_start'],
-                "Bedtime End": entry['bedtime_end'],
-                "Sleep Start": entry['sleeptime_start'],
-                "Sleep End": entry['sleeptime_end'],
-                "Deep Sleep": entry['deep_sleep_duration'],
-                "Awake (Filtered)": entry['awake_time_filtered'],
-                "Light Sleep": entry['light_sleep_duration'],
-                "REM Sleep": entry['rem_sleep_duration'],
-                "Total Sleep": entry['total_sleep_duration']
-            })
+        writer.writerow(fieldnames)
+        writer.writerows(map(_get_row, processed_data))
     print(f"Sleep data saved to {filename}")
 
 
@@ -173,11 +313,16 @@ if __name__ == '__main__':
     start_date = '2024-06-20'
     end_date = '2024-07-02'
 
-    ultrahuman_raw_data = get_ultrahuman_sleep_data(start_date, end_date)
+    # Materialized here only because the raw entries are printed before processing
+    ultrahuman_raw_data = list(get_ultrahuman_sleep_data(start_date, end_date))
     if ultrahuman_raw_data:
         print("\nRaw data for 2024-07-01:")
+        # Local-time [midnight, next midnight) window for the target date, as unix timestamps
+        target_date = datetime.fromisoformat('2024-07-01')
+        window_start = target_date.timestamp()
+        window_end = (target_date + timedelta(days=1)).timestamp()
         for entry in ultrahuman_raw_data:
-            if datetime.fromtimestamp(entry['object']['bedtime_start']).date().isoformat() == '2024-07-01':
+            if window_start <= entry['object']['bedtime_start'] < window_end:
                 print(entry)
         
         ultrahuman_processed_data = process_ultrahuman_sleep_data(ultrahuman_raw_data)